@@ -2,135 +2,477 @@
 """
 Memory-efficient sitemap generator
 
-- Streams HTML files to sitemap parts immediately (no full page_data in memory)
+- Streams HTML files to sitemap parts immediately (no full page_data in memory unless --cache is given)
+- Optionally reuses parse results for unchanged pages from a JSON cache (--cache)
 - Extracts images and videos (canonical)
 - Auto-splits at 1000 URLs per part by default
 - Generates sitemap_index.xml
 """
 
 import argparse
+import json
+import math
+import mmap
+import os
 import re
-import xml.etree.ElementTree as eTree
-from datetime import datetime, timezone
+import shutil
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from html import unescape
+from itertools import repeat
 from pathlib import Path
 from urllib.parse import urljoin, urlparse
-from xml.dom import minidom
+from xml.sax.saxutils import escape
 
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
+from bs4.builder import builder_registry
+from lxml import etree
 from tqdm import tqdm
 
-VIDEO_EXTENSIONS = {".mp4", ".webm", ".mov", ".wmv"}
-HTML_EXTENSIONS = {".htm", ".html"}
+VIDEO_EXTENSIONS = frozenset({".mp4", ".webm", ".mov", ".wmv"})
+HTML_SUFFIXES = (".htm", ".html")
+ASSETS_BASE_URL = "https://assets.dvrbs.camdenhistory.com/"
 XML_STYLESHEET = '<?xml-stylesheet type="text/xsl" href="/sitemap-style.xsl" ?>\n'
 split_count = 1000
-
-
-def write_url_element(f, page_url, lastmod_date, image_urls, video_data, image_seen, video_seen):
-    f.write("  <url>\n")
-    f.write(f"    <loc>{page_url}</loc>\n")
-    f.write(f"    <lastmod>{lastmod_date}</lastmod>\n")
-    f.write("    <changefreq>weekly</changefreq>\n")
-    f.write("    <priority>0.5</priority>\n")
-
-    for img_url in sorted(image_urls):
-        if img_url in image_seen:
+# Parts are assembled in memory and written in one go; only very large parts are flushed early
+PART_FLUSH_SIZE = 16 * 1024 * 1024
+READ_AHEAD_DEPTH = 16
+MAX_CHUNKSIZE = 64
+CACHE_VERSION = 2
+READ_AHEAD_THREADS = 4
+MMAP_MIN_SIZE = 4096
+BLOOM_ERROR_RATE = 1e-6
+PART_WRITER_THREADS = 4
+
+PART_HEADER = (
+    '<?xml version="1.0" encoding="utf-8"?>\n'
+    + XML_STYLESHEET
+    + '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9"\n'
+    '        xmlns:image="http://www.google.com/schemas/sitemap-image/1.1"\n'
+    '        xmlns:video="http://www.google.com/schemas/sitemap-video/1.1">\n'
+).encode("utf-8")
+PART_FOOTER = b"</urlset>\n"
+
+# Per-record XML fragments; each <url> block is assembled from these and written at once
+URL_OPEN_TEMPLATE = (
+    "  <url>\n"
+    "    <loc>{loc}</loc>\n"
+    "    <lastmod>{lastmod}</lastmod>\n"
+    "    <changefreq>weekly</changefreq>\n"
+    "    <priority>0.5</priority>\n"
+)
+IMAGE_TEMPLATE = (
+    "    <image:image>\n"
+    "      <image:loc>{loc}</image:loc>\n"
+    "    </image:image>\n"
+)
+VIDEO_TEMPLATE = (
+    "    <video:video>\n"
+    "      <video:content_loc>{loc}</video:content_loc>\n"
+    "      <video:title>{title}</video:title>\n"
+    "      <video:description>{desc}</video:description>\n"
+    "    </video:video>\n"
+)
+URL_CLOSE = "  </url>\n"
+# Bound once so the per-record path skips the attribute lookups
+format_url_open = URL_OPEN_TEMPLATE.format
+format_image = IMAGE_TEMPLATE.format
+format_video = VIDEO_TEMPLATE.format
+SITEMAP_INDEX_TEMPLATE = (
+    "  <sitemap>\n"
+    "    <loc>{loc}</loc>\n"
+    "    <lastmod>{lastmod}</lastmod>\n"
+    "  </sitemap>"
+)
+
+# Shared by every page a process parses; comments and PIs are dropped at parse time since nothing reads them
+HTML_PARSER = etree.HTMLParser(encoding="utf-8", remove_comments=True, remove_pis=True)
+# Compiled once; XPath returns attribute values as plain strings straight from libxml2
+IMG_SRC = etree.XPath("//img/@src", smart_strings=False)
+VIDEO_NODES = etree.XPath("//video")
+VIDEO_SOURCE_SRC = etree.XPath("(.//source)[1]/@src", smart_strings=False)
+# Used by the BeautifulSoup parsers; only <img>, <video> and <source> are ever inspected
+MEDIA_STRAINER = SoupStrainer(["img", "video", "source"])
+PARSERS = ("lxml", "html.parser", "html5lib", "regex")
+# "regex" parser: scan raw bytes for <img src>; pages containing <video> still go through lxml
+IMG_SRC_RE = re.compile(rb"""<img\b[^>]*?\ssrc\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s>]+))""", re.IGNORECASE)
+VIDEO_TAG_RE = re.compile(rb"<video\b", re.IGNORECASE)
+_PART_PATTERN_CACHE = {}
+_LASTMOD_CACHE = {}
+
+
+def lower_suffix(name):
+    # Only the few characters after the last dot are sliced and lowercased, not the whole name
+    dot = name.rfind(".")
+    return name[dot:].lower() if dot > 0 else ""
+
+
+def iter_html_files(root):
+    # Iterative os.scandir walk: DirEntry caches the type (and on most platforms stat) info.
+    # The name test runs before is_file() so images and CSS never reach a stat call
+    stack = [root]
+    while stack:
+        try:
+            it = os.scandir(stack.pop())
+        except OSError:
+            # Unreadable directories are skipped, as Path.rglob did
+            continue
+        with it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                # As with Path.suffix, a leading dot is not a suffix: a dotfile named ".html" is skipped
+                elif (entry.name[-5:].lower().endswith(HTML_SUFFIXES)
+                      and entry.name.rfind(".") > 0 and entry.is_file()):
+                    yield entry
+
+
+def format_lastmod(timestamp):
+    # Local time, W3C datetime with a +HH:MM offset. time.localtime() resolves the offset per
+    # timestamp, so files on either side of a DST change still get the right one
+    seconds = int(timestamp)
+    lastmod = _LASTMOD_CACHE.get(seconds)
+    if lastmod is None:
+        stamp = time.strftime("%Y-%m-%dT%H:%M:%S%z", time.localtime(seconds))
+        # Builds and deploys stamp whole trees with the same few mtimes, so most lookups hit
+        lastmod = _LASTMOD_CACHE[seconds] = f"{stamp[:-2]}:{stamp[-2:]}"
+    return lastmod
+
+
+def extract_media(html, parser="lxml"):
+    if parser == "regex":
+        return extract_media_regex(html)
+    if parser != "lxml":
+        return extract_media_bs4(html, parser)
+    try:
+        doc = etree.HTML(html, HTML_PARSER)
+    except etree.LxmlError:
+        # libxml2 gave up even in recover mode; html.parser is slower but always available
+        return extract_media_bs4(html, "html.parser")
+    return extract_media_doc(doc)
+
+
+def extract_media_file(path, parser="lxml"):
+    if parser == "regex":
+        with map_html(path) as html:
+            return extract_media_regex(html)
+    if parser != "lxml":
+        return extract_media_bs4(read_html(path), parser)
+    try:
+        # libxml2 reads the file itself, so the page never exists as a Python bytes object
+        doc = etree.parse(path, HTML_PARSER).getroot()
+    except etree.LxmlError:
+        return extract_media_bs4(read_html(path), "html.parser")
+    return extract_media_doc(doc)
+
+
+def extract_media_doc(doc):
+    if doc is None:
+        return [], []
+    videos = []
+    for video in VIDEO_NODES(doc):
+        video_src = video.get("src")
+        if not video_src:
+            source_src = VIDEO_SOURCE_SRC(video)
+            video_src = source_src[0] if source_src else None
+        videos.append((video_src, video))
+    return IMG_SRC(doc), videos
+
+
+def extract_media_regex(html):
+    if VIDEO_TAG_RE.search(html):
+        # lxml needs real bytes; for bytes input this is the same object, for an mmap it is one copy
+        return extract_media(bytes(html), "lxml")
+    image_srcs = []
+    for match in IMG_SRC_RE.finditer(html):
+        src = match.group(1) or match.group(2) or match.group(3) or b""
+        image_srcs.append(unescape(src.decode("utf-8", errors="replace")))
+    return image_srcs, []
+
+
+def extract_media_bs4(html, parser):
+    # html5lib always builds the full tree and warns if given parse_only
+    strainer = None if parser == "html5lib" else MEDIA_STRAINER
+    soup = BeautifulSoup(html, parser, parse_only=strainer, from_encoding="utf-8")
+    image_srcs = [img.get("src") for img in soup.find_all("img")]
+    videos = []
+    for video_tag in soup.find_all("video"):
+        video_src = video_tag.get("src") or ((source := video_tag.find("source")) and source.get("src"))
+        videos.append((video_src, video_tag))
+    return image_srcs, videos
+
+
+class BloomFilter:
+    # Approximate set of media fingerprints in a fixed bit array. A false positive makes a new URL look
+    # already written, so it is left out of the sitemap; the error rate is kept far below the usual 1%
+    def __init__(self, capacity, error_rate=BLOOM_ERROR_RATE):
+        self.bit_count = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.bit_count / capacity * math.log(2)))
+        self.bits = bytearray((self.bit_count + 7) // 8)
+        self.count = 0
+
+    def _positions(self, fingerprint):
+        # Double hashing: derive every probe position from the two halves of the 64-bit fingerprint
+        fingerprint &= 0xFFFFFFFFFFFFFFFF
+        h1, h2 = fingerprint & 0xFFFFFFFF, (fingerprint >> 32) | 1
+        return [(h1 + i * h2) % self.bit_count for i in range(self.hash_count)]
+
+    def __contains__(self, fingerprint):
+        bits = self.bits
+        return all(bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(fingerprint))
+
+    def add(self, fingerprint):
+        bits = self.bits
+        for pos in self._positions(fingerprint):
+            bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __len__(self):
+        # Callers only add after a failed membership test, so this is the number of URLs written
+        return self.count
+
+
+def write_url_element(buf, page_url, lastmod_date, image_urls, video_data, image_seen, video_seen):
+    # Build the whole <url> block first so it is encoded and appended in one go
+    parts = [format_url_open(loc=page_url, lastmod=lastmod_date)]
+    append = parts.append
+
+    for img_url in image_urls:
+        fingerprint = hash(img_url)
+        if fingerprint in image_seen:
             continue
-        f.write("    <image:image>\n")
-        f.write(f"      <image:loc>{img_url}</image:loc>\n")
-        f.write("    </image:image>\n")
-        image_seen.add(img_url)
+        append(format_image(loc=img_url))
+        image_seen.add(fingerprint)
 
     for video_url, title, desc in video_data:
-        if video_url in video_seen:
+        fingerprint = hash(video_url)
+        if fingerprint in video_seen:
+            continue
+        append(format_video(loc=video_url, title=title, desc=desc))
+        video_seen.add(fingerprint)
+
+    append(URL_CLOSE)
+    buf += "".join(parts).encode("utf-8")
+
+
+def read_html(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+@contextmanager
+def map_html(path):
+    # Zero-copy view of the page for the regex scanner; tiny files are cheaper to just read
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size < MMAP_MIN_SIZE:
+            yield f.read()
+        else:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                yield mm
+
+
+def read_ahead(html_files, depth=READ_AHEAD_DEPTH):
+    # Keep up to `depth` reads in flight on a thread pool (file IO releases the GIL), so disk latency
+    # overlaps parsing; the window bounds how many pages are held in memory
+    with ThreadPoolExecutor(max_workers=READ_AHEAD_THREADS) as executor:
+        pending = deque()
+        for html_file in html_files:
+            pending.append((html_file, executor.submit(read_html, html_file[0])))
+            if len(pending) >= depth:
+                html_file, future = pending.popleft()
+                yield html_file, future.result()
+        while pending:
+            html_file, future = pending.popleft()
+            yield html_file, future.result()
+
+
+def finish_part(part_file, part_buffer):
+    with part_file:
+        part_file.write(part_buffer)
+
+
+def parse_one(html_file, site_root, page_base_url, parser="lxml"):
+    return parse_page(html_file, extract_media_file(html_file[0], parser), site_root, page_base_url)
+
+
+def parse_page(html_file, media, site_root, page_base_url):
+    file_path, mtime = html_file
+    # Make relative path from site_root, not first HTML file. A relative filesystem path has no
+    # scheme or authority, so plain concatenation gives the same URL as urljoin without reparsing the base
+    rel_path = os.path.relpath(file_path, site_root)
+    if os.sep != "/":
+        rel_path = rel_path.replace(os.sep, "/")
+    page_url = page_base_url + rel_path
+    lastmod_date = format_lastmod(mtime)
+
+    image_srcs, videos = media
+    # Insertion-ordered dedup: images are written in document order, so no per-page sort is needed
+    image_urls = {}
+    for src in image_srcs:
+        if not src:
+            continue
+        src = src.strip()
+        # Skip absolute URLs and data URIs
+        if src.startswith(("http://", "https://", "//", "data:")):
+            image_urls[escape(src)] = None
+        else:
+            # Normalize and prepend your new domain
+            normalized_src = src.lstrip("./")  # remove leading ./ or /
+            full_url = urljoin(ASSETS_BASE_URL, normalized_src)
+            image_urls[escape(full_url)] = None
+
+    video_data = []
+    for video_src, video_tag in videos:
+        if not video_src or lower_suffix(video_src) not in VIDEO_EXTENSIONS:
             continue
-        f.write("    <video:video>\n")
-        f.write(f"      <video:content_loc>{video_url}</video:content_loc>\n")
-        f.write(f"      <video:title>{title}</video:title>\n")
-        f.write(f"      <video:description>{desc}</video:description>\n")
-        f.write("    </video:video>\n")
-        video_seen.add(video_url)
+        video_url = urljoin(page_url, video_src)
+        title = video_tag.get("title") or video_tag.get("data-title") or "Untitled"
+        desc = video_tag.get("description") or video_tag.get("data-description") or title
+        video_data.append((escape(video_url), escape(title), escape(desc)))
+
+    # Everything returned is already XML-escaped, so the writer can drop it straight into the templates
+    return escape(page_url), lastmod_date, tuple(image_urls), video_data
+
 
-    f.write("  </url>\n")
+def pool_chunksize(file_count, workers):
+    # Large chunks amortise pickling/IPC, but small sites still need several chunks per worker to keep all busy
+    return max(1, min(MAX_CHUNKSIZE, file_count // (workers * 4)))
 
 
-def generate_sitemap_parts_streamed(html_files, site_base_url, output_dir, site_root, split_limit=split_count):
+def load_parse_cache(cache_path, cache_key):
+    try:
+        with open(cache_path, "rb") as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    # Entries are only reusable if they were produced with the same parser, base URL and site root
+    if not isinstance(cache, dict) or cache.get("key") != cache_key:
+        return {}
+    return cache.get("pages", {})
+
+
+def save_parse_cache(cache_path, cache_key, pages):
+    # Write beside the target and rename over it, so an interrupted run never leaves a truncated cache
+    fd, tmp_path = tempfile.mkstemp(dir=cache_path.parent, prefix=cache_path.name, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({"key": cache_key, "pages": pages}, f, separators=(",", ":"))
+        os.replace(tmp_path, cache_path)
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+
+
+def generate_sitemap_parts_streamed(html_files, site_base_url, output_dir, site_root, split_limit=split_count,
+                                    workers=None, parser="lxml", cache_path=None, bloom_capacity=None):
     output_dir = Path(output_dir).resolve()
     site_root = Path(site_root).resolve()
     output_dir.mkdir(parents=True, exist_ok=True)
 
     part_files = []
-    image_seen = set()
+    # Dedup on 64-bit hash() fingerprints instead of holding every media URL string; the sets never
+    # leave this process, so the per-run hash seed is irrelevant
+    image_seen = BloomFilter(bloom_capacity) if bloom_capacity else set()
     video_seen = set()
+    # Fingerprints of whole per-page image lists already written; templated pages repeat the same list
+    image_sets_seen = set()
     part_file = None
+    part_buffer = bytearray()
+    part_writes = []
     urls_in_part = 0
     part_count = 0
-
-    for file_path in tqdm(html_files, desc="Processing HTML files"):
-        if part_file is None or urls_in_part >= split_limit:
-            if part_file:
-                part_file.write("</urlset>\n")
-                part_file.close()
-            part_count += 1
-            part_file_path = output_dir / f"sitemap-{part_count}.xml"
-            part_file = open(part_file_path, "w", encoding="utf-8")
-            part_file.write('<?xml version="1.0" encoding="utf-8"?>\n')
-            part_file.write(XML_STYLESHEET)
-            part_file.write('<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9"\n')
-            part_file.write('        xmlns:image="http://www.google.com/schemas/sitemap-image/1.1"\n')
-            part_file.write('        xmlns:video="http://www.google.com/schemas/sitemap-video/1.1">\n')
-            urls_in_part = 0
-            part_files.append(part_file_path)
-
-        # Make relative path from site_root, not first HTML file
-        rel_path = file_path.relative_to(site_root)
-        page_url = urljoin(site_base_url.rstrip("/") + "/", rel_path.as_posix())
-        mtime = file_path.stat().st_mtime
-        lastmod_date = datetime.fromtimestamp(mtime, tz=timezone.utc).replace(microsecond=0).astimezone().isoformat()
-
-        html = file_path.read_text(encoding="utf-8", errors="ignore")
-        soup = BeautifulSoup(html, "lxml")
-        image_urls = set()
-        for img in soup.find_all("img"):
-            src = img.get("src")
-            if not src:
-                continue
-            src = src.strip()
-            # Skip absolute URLs and data URIs
-            if src.startswith(("http://", "https://", "//", "data:")):
-                image_urls.add(src)
+    page_base_url = site_base_url.rstrip("/") + "/"
+
+    # Pages whose mtime matches the previous run's cache are not read or parsed again
+    cache_key = [CACHE_VERSION, parser, page_base_url, str(site_root)]
+    cached_pages = load_parse_cache(cache_path, cache_key) if cache_path else {}
+    fresh_pages = {}
+    to_parse = [html_file for html_file in html_files if cached_pages.get(html_file[0], (None,))[0] != html_file[1]]
+
+    # Parsing runs in worker processes (or in-process with read-ahead when workers == 1); writing stays
+    # here so part order and the seen sets stay consistent
+    with ExitStack() as stack:
+        # A finished part's last write and close run on a writer thread, overlapping the next part's
+        # build; mid-part flushes stay inline so each file's writes keep their order
+        writer = stack.enter_context(ThreadPoolExecutor(max_workers=PART_WRITER_THREADS))
+        if workers == 1:
+            results = (parse_page(html_file, extract_media(html, parser), site_root, page_base_url)
+                       for html_file, html in read_ahead(to_parse))
+        else:
+            executor = stack.enter_context(ProcessPoolExecutor(max_workers=workers))
+            chunksize = pool_chunksize(len(to_parse), workers or os.cpu_count() or 1)
+            results = executor.map(parse_one, to_parse, repeat(site_root), repeat(page_base_url), repeat(parser),
+                                   chunksize=chunksize)
+        for file_path, mtime in tqdm(html_files, desc="Processing HTML files"):
+            cached = cached_pages.get(file_path)
+            if cached and cached[0] == mtime:
+                _, page_url, lastmod_date, image_urls, video_data = cached
+                image_urls = tuple(image_urls)
             else:
-                # Normalize and prepend your new domain
-                normalized_src = src.lstrip("./")  # remove leading ./ or /
-                full_url = urljoin("https://assets.dvrbs.camdenhistory.com/", normalized_src)
-                image_urls.add(full_url)
-
-        video_data = []
-        for video_tag in soup.find_all("video"):
-            video_src = video_tag.get("src") or (video_tag.find("source") and video_tag.find("source").get("src"))
-            if not video_src or Path(video_src).suffix.lower() not in VIDEO_EXTENSIONS:
-                continue
-            video_url = urljoin(page_url, video_src)
-            title = video_tag.get("title") or video_tag.get("data-title") or "Untitled"
-            desc = video_tag.get("description") or video_tag.get("data-description") or title
-            video_data.append((video_url, title, desc))
-
-        write_url_element(part_file, page_url, lastmod_date, image_urls, video_data, image_seen, video_seen)
-        urls_in_part += 1
-
-    if part_file:
-        part_file.write("</urlset>\n")
-        part_file.close()
+                page_url, lastmod_date, image_urls, video_data = next(results)
+            if cache_path:
+                fresh_pages[file_path] = [mtime, page_url, lastmod_date, image_urls, video_data]
+
+            if part_file is None or urls_in_part >= split_limit:
+                if part_file:
+                    part_buffer += PART_FOOTER
+                    part_writes.append(writer.submit(finish_part, part_file, part_buffer))
+                    part_buffer = bytearray()
+                part_count += 1
+                part_file_path = output_dir / f"sitemap-{part_count}.xml"
+                part_file = open(part_file_path, "wb")
+                part_buffer += PART_HEADER
+                urls_in_part = 0
+                part_files.append(part_file_path)
+
+            if image_urls:
+                image_set_fingerprint = hash(image_urls)
+                if image_set_fingerprint in image_sets_seen:
+                    # Every URL of a list written before is already in image_seen
+                    image_urls = ()
+                else:
+                    image_sets_seen.add(image_set_fingerprint)
+
+            write_url_element(part_buffer, page_url, lastmod_date, image_urls, video_data, image_seen, video_seen)
+            urls_in_part += 1
+            if len(part_buffer) >= PART_FLUSH_SIZE:
+                part_file.write(part_buffer)
+                part_buffer.clear()
+
+        if part_file:
+            part_buffer += PART_FOOTER
+            part_writes.append(writer.submit(finish_part, part_file, part_buffer))
+
+    # Surface any write error from the writer threads
+    for part_write in part_writes:
+        part_write.result()
+
+    # Rewritten from this run's pages only, so deleted files drop out of the cache
+    if cache_path:
+        save_parse_cache(cache_path, cache_key, fresh_pages)
 
     return part_files, image_seen, video_seen
 
 
+def part_pattern(part_prefix):
+    pattern = _PART_PATTERN_CACHE.get(part_prefix)
+    if pattern is None:
+        pattern = _PART_PATTERN_CACHE[part_prefix] = re.compile(rf"^{re.escape(part_prefix)}-\d+\.xml$")
+    return pattern
+
+
 def cleanup_old_parts(output_dir: Path, part_prefix, part_files_current):
     current_filenames = set(Path(f).name for f in part_files_current)
-    existing_files = list(output_dir.glob(f"{part_prefix}-*.xml"))
-    pattern = re.compile(rf"^{re.escape(part_prefix)}-\d+\.xml$")
+    pattern = part_pattern(part_prefix)
+    # The regex alone decides, so list the directory directly instead of compiling a glob as well
+    with os.scandir(output_dir) as it:
+        existing_files = [Path(entry.path) for entry in it if pattern.match(entry.name)]
     removed_count = 0
     for file_path in existing_files:
-        if pattern.match(file_path.name) and file_path.name not in current_filenames:
+        if file_path.name not in current_filenames:
             try:
                 file_path.unlink()
                 removed_count += 1
@@ -146,34 +488,32 @@ def cleanup_old_parts(output_dir: Path, part_prefix, part_files_current):
 def generate_sitemap_index(part_files, output_dir: Path, site_base_url):
     parsed_base_url = urlparse(site_base_url)
     sitemap_base_url = f"{parsed_base_url.scheme}://{parsed_base_url.netloc}/"
+    # Part names are bare filenames, so joining onto the host root is a plain concatenation
+    loc_base = escape(sitemap_base_url)
     index_filename = output_dir / "sitemap_index.xml"
 
-    sitemapindex = eTree.Element("sitemapindex", {"xmlns": "http://www.sitemaps.org/schemas/sitemap/0.9"})
-    now = datetime.now(timezone.utc).replace(microsecond=0).astimezone().isoformat()
+    # All entries share one timestamp, so bind it into the template once rather than per part
+    entry_template = SITEMAP_INDEX_TEMPLATE.format(loc="{loc}", lastmod=format_lastmod(time.time()))
 
+    # The index layout is fixed, so emit it directly rather than building and re-parsing a DOM
+    lines = [
+        '<?xml version="1.0" encoding="utf-8"?>',
+        XML_STYLESHEET.rstrip("\n"),
+        '<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">',
+    ]
     for part_path in part_files:
-        sitemap_elem = eTree.SubElement(sitemapindex, "sitemap")
-        eTree.SubElement(sitemap_elem, "loc").text = urljoin(sitemap_base_url, part_path.name)
-        eTree.SubElement(sitemap_elem, "lastmod").text = now
-
-    # Serialize and pretty-print
-    rough_string = eTree.tostring(sitemapindex, encoding="utf-8")
-    reparsed = minidom.parseString(rough_string)
-    pretty_xml = reparsed.toprettyxml(indent="  ")
-
-    with index_filename.open("w", encoding="utf-8") as f:
-        f.write('<?xml version="1.0" encoding="utf-8"?>\n')
-        f.write(XML_STYLESHEET)
-        # Strip the duplicate declaration from minidom output
-        f.write("\n".join(pretty_xml.splitlines()[1:]))
+        lines.append(entry_template.format(loc=loc_base + part_path.name))
+    lines.append("</sitemapindex>\n")
+    index_filename.write_bytes("\n".join(lines).encode("utf-8"))
 
-    return index_filename, urljoin(sitemap_base_url, index_filename.name)
+    return index_filename, sitemap_base_url + index_filename.name
 
 
 def copy_stylesheet_to_site(site_root: Path, stylesheet_src: Path):
     destination = site_root / "sitemap-style.xsl"
     try:
-        destination.write_text(stylesheet_src.read_text(encoding="utf-8"), encoding="utf-8")
+        # Byte copy (sendfile on Linux); no reason to decode and re-encode the stylesheet
+        shutil.copyfile(stylesheet_src, destination)
         print(f"Copied sitemap stylesheet to: {destination}")
     except Exception as e:
         print(f"Failed to copy stylesheet: {e}")
@@ -185,7 +525,23 @@ def main():
     parser.add_argument("--site_root", required=True, help="Path to site's HTML files")
     parser.add_argument("--output", default="sitemap_index.xml", help="Output sitemap index filename")
     parser.add_argument("--split", type=int, default=split_count, help="Max URLs per sitemap part")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Parser processes (default: one per CPU); 1 parses in-process with read-ahead")
+    parser.add_argument("--cache", type=Path, default=None, metavar="PATH",
+                        help="Reuse unchanged pages' parse results from this JSON file (keep it outside the site root)")
+    parser.add_argument("--bloom-capacity", type=int, default=None,
+                        help="Expected number of unique images; dedup them with a compact Bloom filter instead of "
+                             "an exact set (may rarely drop an image)")
+    parser.add_argument("--parser", default="lxml", choices=PARSERS,
+                        help="HTML parser; the BeautifulSoup ones are slower but more lenient")
     args = parser.parse_args()
+    if args.bloom_capacity is not None and args.bloom_capacity < 1:
+        parser.error("--bloom-capacity must be at least 1")
+    if args.workers is not None and args.workers < 1:
+        parser.error("--workers must be at least 1")
+    # lxml and regex modes use lxml.etree directly; the others need a BeautifulSoup tree builder
+    if args.parser not in ("lxml", "regex") and builder_registry.lookup(args.parser) is None:
+        parser.error(f"--parser={args.parser} is not installed (pip install {args.parser})")
 
     site_root_path = Path(args.site_root).resolve()
     output_path = Path(args.output)
@@ -193,7 +549,8 @@ def main():
         output_path = site_root_path / output_path.name
 
     # Gather all HTML files
-    html_files = [f for f in site_root_path.rglob("*") if f.suffix.lower() in HTML_EXTENSIONS]
+    # (path, mtime) pairs: the stat is taken from the DirEntry, and plain tuples pickle cheaply to the workers
+    html_files = [(entry.path, entry.stat().st_mtime) for entry in iter_html_files(site_root_path)]
     print(f"Scanning {len(html_files)} HTML files...")
 
     # Generate sitemap parts (streamed)
@@ -202,7 +559,11 @@ def main():
         args.site_base_url,
         output_path.parent,
         site_root_path,
-        split_limit=args.split
+        split_limit=args.split,
+        workers=args.workers,
+        parser=args.parser,
+        cache_path=args.cache,
+        bloom_capacity=args.bloom_capacity
     )
 
     # Cleanup old parts
@@ -221,6 +582,10 @@ def main():
     print(f"  Sitemap parts: {len(part_files)}")
     print(f"  Unique images: {len(image_seen)}")
     print(f"  Unique videos: {len(video_seen)}")
+    if args.bloom_capacity and len(image_seen) > args.bloom_capacity:
+        # Past its capacity the filter's false-positive rate climbs, so more images may have been dropped
+        print(f"⚠️ {len(image_seen)} unique images exceed --bloom-capacity={args.bloom_capacity}; "
+              f"rerun with a larger capacity or without it")
     print(f"\n🔗 Submit this URL to search engines: {sitemap_index_url}")
 
 
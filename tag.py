@@ -1,98 +1,141 @@
 import os
+import re
 import shutil
-from copy import deepcopy
+import tempfile
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from bs4 import BeautifulSoup
 
 root_dir = "/media/sage/crucial1/dvrbs/dvrbs.camdenhistory.com"
-tag_html = '<link rel="preconnect" href="https://assets.dvrbs.camdenhistory.com" crossorigin>'
+preconnect_href = "https://assets.dvrbs.camdenhistory.com"
 extensions = {".html", ".htm"}
+# The quoted bare origin does not match asset URLs like images (those carry a path)
+preconnect_href_marker = f'href="{preconnect_href}"'.encode("utf-8")
+# Comments and script/style bodies (unclosed ones run to the end) are matched too, so <link> markup
+# inside them is stepped over rather than mistaken for a real tag
+link_tag_re = re.compile(rb"<!--.*?(?:-->|\Z)|<(script|style)\b.*?(?:</\1\s*>|\Z)|(?P<link><link\b[^>]*>)",
+                         re.IGNORECASE | re.DOTALL)
+html_root_re = re.compile(rb"<html[\s>]", re.IGNORECASE)
+print_lock = threading.Lock()
 
-# Parse the tag once, outside the loop
-new_tag_template = BeautifulSoup(tag_html, "html.parser").link
-
-# Counters
-added_count = 0
-updated_count = 0
-skipped_count = 0
-nohead_count = 0
-error_count = 0
-
-for dirpath, _, filenames in os.walk(root_dir):
-    for filename in filenames:
-        if os.path.splitext(filename)[1].lower() in extensions:
-            filepath = os.path.join(dirpath, filename)
-            try:
-                with open(filepath, "r", encoding="utf-8") as f:
-                    soup = BeautifulSoup(f, "html.parser")
-            except Exception as e:
-                print(f"Skipping {filepath}: {e}")
-                error_count += 1
-                continue
-
-            # Match any link with the correct href and a rel containing "preconnect"
-            existing = soup.find(
-                "link",
-                href="https://assets.dvrbs.camdenhistory.com",
-                rel=lambda r: r and (
-                    ("preconnect" in r) if isinstance(r, list)
-                    else "preconnect" in r.lower()
-                )
-            )
-
-            if existing:
-                # Upgrade it if crossorigin is missing
-                if not existing.has_attr("crossorigin"):
-                    existing["crossorigin"] = "crossorigin"
-
-                    # Backup before writing
-                    backup_path = filepath + ".bak"
-                    if not os.path.exists(backup_path):
-                        os.rename(filepath, backup_path)
-                    else:
-                        shutil.copy2(filepath, backup_path)
-
-                    with open(filepath, "w", encoding="utf-8") as f:
-                        f.write(soup.decode())
-
-                    print(f"🔧 Updated tag in {filepath}")
-                    updated_count += 1
-                else:
-                    print(f"⏭️  Skipped (already correct): {filepath}")
-                    skipped_count += 1
-                continue
-
-            head_tag = soup.head or soup.find("head")
-            if head_tag:
-                # Clone the pre-parsed tag
-                new_tag = deepcopy(new_tag_template)
-
-                # Only insert newline if the first element isn't already whitespace
-                if not (head_tag.contents and isinstance(head_tag.contents[0], str) and head_tag.contents[0].strip() == ""):
-                    head_tag.insert(0, soup.new_string("\n    "))
-                    head_tag.insert(1, new_tag)
-                else:
-                    head_tag.insert(1, new_tag)
-
-                # Backup before writing
-                backup_path = filepath + ".bak"
-                if not os.path.exists(backup_path):
-                    os.rename(filepath, backup_path)
-                else:
-                    shutil.copy2(filepath, backup_path)
-
-                with open(filepath, "w", encoding="utf-8") as f:
-                    f.write(soup.decode())
-
-                print(f"✅ Added tag to {filepath}")
-                added_count += 1
-            else:
-                print(f"⚠️ No <head> found in {filepath}")
-                nohead_count += 1
-
-# Summary
-print("\n--- Summary ---")
-print(f"Added:   {added_count}")
-print(f"Updated: {updated_count}")
-print(f"Skipped: {skipped_count}")
-print(f"No <head>: {nohead_count}")
-print(f"Errors:  {error_count}")
+
+def write_with_backup(filepath, new_data):
+    # Backup before writing: hard-link the current file as the .bak (no data copy), then swap the new
+    # content in with an atomic rename so the page is never seen half-written
+    backup_path = filepath + ".bak"
+    if os.path.exists(backup_path):
+        os.unlink(backup_path)
+    try:
+        os.link(filepath, backup_path)
+    except OSError:
+        # Filesystems without hard links
+        shutil.copy2(filepath, backup_path)
+
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(filepath), prefix=os.path.basename(filepath), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(new_data)
+        # mkstemp creates the file 0600; keep the page's original permissions
+        shutil.copymode(filepath, tmp_path)
+        os.replace(tmp_path, filepath)
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+
+
+def already_done(data):
+    # Same link the parse would pick: the first preconnect <link> for our origin. The page is done only
+    # when that tag itself carries crossorigin; markers elsewhere (fonts, scripts) don't count
+    for match in link_tag_re.finditer(data):
+        tag = match.group("link")
+        if tag and preconnect_href_marker in tag and b"preconnect" in tag:
+            return b"crossorigin" in tag
+    return False
+
+
+def report(message):
+    # Workers share stdout; keep each line whole
+    with print_lock:
+        print(message)
+
+
+def process_file(filepath):
+    try:
+        with open(filepath, "rb") as f:
+            data = f.read()
+        # Most pages are already done; a substring scan is far cheaper than a parse
+        if already_done(data):
+            report(f"⏭️  Skipped (already correct): {filepath}")
+            return "skipped"
+        # lxml wraps fragments (head-only includes) in <html>/<body>; html.parser writes them back unwrapped
+        builder = "lxml" if html_root_re.search(data) else "html.parser"
+        soup = BeautifulSoup(data.decode("utf-8"), builder)
+    except Exception as e:
+        report(f"Skipping {filepath}: {e}")
+        return "error"
+
+    # Match any link with the correct href and a rel containing "preconnect"
+    existing = soup.find(
+        "link",
+        href=preconnect_href,
+        rel=lambda r: r and (
+            ("preconnect" in r) if isinstance(r, list)
+            else "preconnect" in r.lower()
+        )
+    )
+
+    if existing:
+        # Upgrade it if crossorigin is missing
+        if not existing.has_attr("crossorigin"):
+            existing["crossorigin"] = "crossorigin"
+
+            write_with_backup(filepath, soup.decode().encode("utf-8"))
+            report(f"🔧 Updated tag in {filepath}")
+            return "updated"
+        report(f"⏭️  Skipped (already correct): {filepath}")
+        return "skipped"
+
+    head_tag = soup.head or soup.find("head")
+    if not head_tag:
+        report(f"⚠️ No <head> found in {filepath}")
+        return "nohead"
+
+    # Build the tag directly on this soup; same markup as <link rel="preconnect" href=... crossorigin>
+    new_tag = soup.new_tag("link", rel="preconnect", href=preconnect_href, crossorigin="")
+
+    # Only insert newline if the first element isn't already whitespace
+    if not (head_tag.contents and isinstance(head_tag.contents[0], str) and head_tag.contents[0].strip() == ""):
+        head_tag.insert(0, soup.new_string("\n    "))
+        head_tag.insert(1, new_tag)
+    else:
+        head_tag.insert(1, new_tag)
+
+    write_with_backup(filepath, soup.decode().encode("utf-8"))
+    report(f"✅ Added tag to {filepath}")
+    return "added"
+
+
+def main():
+    paths = [
+        os.path.join(dirpath, filename)
+        for dirpath, _, filenames in os.walk(root_dir)
+        for filename in filenames
+        if os.path.splitext(filename)[1].lower() in extensions
+    ]
+
+    # Pages are independent and the work is mostly file IO plus lxml parsing, so threads overlap well
+    with ThreadPoolExecutor(max_workers=(os.cpu_count() or 1) * 2) as executor:
+        counts = Counter(executor.map(process_file, paths))
+
+    # Summary
+    print("\n--- Summary ---")
+    print(f"Added:   {counts['added']}")
+    print(f"Updated: {counts['updated']}")
+    print(f"Skipped: {counts['skipped']}")
+    print(f"No <head>: {counts['nohead']}")
+    print(f"Errors:  {counts['error']}")
+
+
+if __name__ == "__main__":
+    main()